@@ -4,6 +4,10 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
+from dotenv import load_dotenv
+
+# Read .env before importing database, so migrations target the same DATABASE_URL as the app
+load_dotenv()
 
 from models import paper, summary
 from database import Base, SQLALCHEMY_DATABASE_URL
@@ -0,0 +1,51 @@
+"""add processing state
+
+Revision ID: 5c1e7a9d4f20
+Revises: 2b2f55782391
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1e7a9d4f20'
+down_revision: Union[str, None] = '2b2f55782391'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('papers', sa.Column('processing_status', sa.String(), nullable=True, server_default='pending'))
+    op.add_column('papers', sa.Column('processing_version', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('papers', sa.Column('processing_started_at', sa.DateTime(), nullable=True))
+    op.add_column('papers', sa.Column('sections_json', sa.Text(), nullable=True))
+    op.add_column('papers', sa.Column('sections_completed', sa.Integer(), nullable=True, server_default='0'))
+
+    # Papers that already have summaries were processed before state was tracked
+    op.execute(
+        "UPDATE papers SET processing_status = 'complete' "
+        "WHERE id IN (SELECT DISTINCT paper_id FROM summaries)"
+    )
+
+    # Remove duplicate summaries left by repeated runs, keeping the first one saved
+    op.execute(
+        "DELETE FROM summaries WHERE id NOT IN ("
+        "SELECT MIN(id) FROM summaries GROUP BY paper_id, section_title, page)"
+    )
+    op.create_index('uq_summaries_paper_section_page', 'summaries', ['paper_id', 'section_title', 'page'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_summaries_paper_section_page', table_name='summaries')
+    with op.batch_alter_table('papers') as batch_op:
+        batch_op.drop_column('sections_completed')
+        batch_op.drop_column('sections_json')
+        batch_op.drop_column('processing_started_at')
+        batch_op.drop_column('processing_version')
+        batch_op.drop_column('processing_status')
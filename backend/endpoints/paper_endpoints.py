@@ -1,13 +1,16 @@
 # endpoints/paper_endpoints.py
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
 from sqlalchemy.orm import Session
 from fastapi.responses import FileResponse
-import os
 import logging
 from database import get_db
 from services.paper_service import PaperService
-from typing import List
+from typing import List, Optional
 from services.llm_responder_service import LLMResponder
+from services.storage_service import get_storage
+from services.job_tracker_service import JobTracker
+from services.rate_limiter_service import llm_rate_limiter
+from services.stream_encoder_service import ProgressStreamEncoder
 from pydantic import BaseModel
 from datetime import datetime
 from fastapi.responses import StreamingResponse
@@ -34,6 +37,7 @@ class PaperResponse(BaseModel):
     upload_date: datetime
     filename: str
     file_path: str
+    processing_status: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -52,28 +56,49 @@ def upload_paper(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """
     try:
         
-        # Save the uploaded file
-        upload_dir = "uploads"
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
+        # Refuse duplicates up front so an existing paper's PDF is never replaced
+        if PaperService.get_paper_by_filename(db, file.filename):
+            raise HTTPException(status_code=409, detail=f"A paper named {file.filename} already exists")
         
-        with open(file_path, "wb") as buffer:
-            buffer.write(file.file.read())
+        # Save the uploaded file
+        storage = get_storage()
+        try:
+            file_path = storage.save(file.filename, file.file)
+        except FileExistsError:
+            raise HTTPException(status_code=409, detail=f"A paper named {file.filename} already exists")
         
-        # Save paper to database
-        paper = PaperService.save_paper(db, file_path, file.filename)
+        # Save paper to database, removing the file again if that fails
+        try:
+            paper = PaperService.save_paper(db, file_path, file.filename)
+        except Exception:
+            storage.delete(file_path)
+            raise
         logger.info(f"Paper saved to database with ID: {paper.id}")
         
         return paper
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file {file.filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
 @paper_router.get("/{paper_id}/process")
-async def process_paper(paper_id: int, db: Session = Depends(get_db)):
+async def process_paper(paper_id: int, request: Request, compress: bool = False,
+                        coalesce_ms: int = 0, compact: bool = False, reprocess: bool = False,
+                        db: Session = Depends(get_db)):
     """
     Process a paper and return streaming updates.
     This endpoint processes a paper and streams back updates as sections are summarized.
+    LLM calls are queued fairly per client (X-Client-ID header, falling back to the
+    client address); a 503 with Retry-After is returned when the queue is full.
+
+    A retry resumes from the last run's checkpoint; pass reprocess=true to discard it
+    (and the existing summaries) and summarize the paper again.
+
+    Stream options:
+    - compress: gzip/brotli-compress the stream according to Accept-Encoding
+    - coalesce_ms: send sections saved within this window as one event with a "sections" list
+    - compact: use the compact event schema (see ProgressStreamEncoder)
     """
     try:
         paper = PaperService.get_paper(db, paper_id=paper_id)
@@ -81,19 +106,58 @@ async def process_paper(paper_id: int, db: Session = Depends(get_db)):
             raise HTTPException(status_code=404, detail="Paper not found")
         
         # Check if file exists
-        if not os.path.exists(paper.file_path):
+        storage = get_storage()
+        if not storage.exists(paper.file_path):
             logger.error(f"PDF file not found at path: {paper.file_path}")
             raise HTTPException(status_code=404, detail="PDF file not found on server")
         
+        if JobTracker.is_draining():
+            raise HTTPException(status_code=503, detail="Server is shutting down, retry on another worker")
+        
+        file_path = storage.resolve(paper.file_path)
+        client_id = request.headers.get("X-Client-ID") or (request.client.host if request.client else "default")
+        
+        # Only one run per paper at a time; the run itself claims the paper when the stream starts
+        if PaperService.is_processing(paper):
+            raise HTTPException(status_code=409, detail="Paper is already being processed")
+        
+        # Papers resuming from a checkpoint don't need the LLM, so only new work is rejected
+        if (reprocess or not paper.sections_json) and llm_rate_limiter.is_full():
+            retry_after = llm_rate_limiter.retry_after()
+            logger.warning(f"LLM queue full, rejecting paper ID {paper_id} from {client_id}")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many papers are being processed, please retry later",
+                headers={"Retry-After": str(retry_after)}
+            )
+        
+        encoding = "identity"
+        if compress:
+            encoding = ProgressStreamEncoder.negotiate_encoding(request.headers.get("Accept-Encoding"))
+        encoder = ProgressStreamEncoder(
+            encoding=encoding,
+            compact=compact,
+            coalesce_window=max(0, coalesce_ms) / 1000
+        )
+        
         async def stream_response():
-            async for update in LLMResponder.process_paper_sections(db, paper.id, paper.file_path):
-                yield update + "\n"
+            async with JobTracker.track():
+                updates = LLMResponder.process_paper_sections(db, paper.id, file_path, client_id, reprocess)
+                async for chunk in encoder.stream(updates):
+                    yield chunk
+        
+        headers = {"Vary": "Accept-Encoding", "X-Accel-Buffering": "no"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
         
         return StreamingResponse(
             stream_response(),
-            media_type="application/x-ndjson"
+            media_type="application/x-ndjson",
+            headers=headers
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing paper ID {paper_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing paper: {str(e)}")
@@ -112,11 +176,12 @@ def view_pdf(paper_id: int, db: Session = Depends(get_db)):
             raise HTTPException(status_code=404, detail="Paper not found")
         
         # Check if file exists
-        if not os.path.exists(paper.file_path):
+        storage = get_storage()
+        if not storage.exists(paper.file_path):
             logger.error(f"PDF file not found at path: {paper.file_path}")
             raise HTTPException(status_code=404, detail="PDF file not found on server")
         
-        return FileResponse(paper.file_path)
+        return FileResponse(storage.resolve(paper.file_path))
 
     except Exception as e:
         logger.error(f"Error serving PDF for paper ID {paper_id}: {str(e)}")
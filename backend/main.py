@@ -1,14 +1,53 @@
+from dotenv import load_dotenv
+
+# Load settings before importing modules that read them (database URL, storage backend)
+load_dotenv()
+
+import os
+import logging
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from endpoints import paper_endpoints, summary_endpoints
-from dotenv import load_dotenv
+from services.llm_responder_service import LLMResponder
+from services.job_tracker_service import JobTracker
+from services.storage_service import get_storage
+from services.rate_limiter_service import llm_rate_limiter
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Seconds uvicorn waits for in-flight processing streams when the server stops
+SHUTDOWN_TIMEOUT = int(os.getenv("SHUTDOWN_TIMEOUT", "60"))
 
-load_dotenv() 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm shared clients on startup and report unfinished processing on shutdown.
+    Runs once per worker process.
+    """
+    get_storage()
+    try:
+        LLMResponder.get_model()
+    except ValueError as e:
+        logger.warning(f"Gemini client not initialized at startup: {str(e)}")
+    # Start draining as soon as the shutdown signal arrives, while uvicorn still serves open streams
+    JobTracker.install_signal_handlers()
+    logger.info(f"Worker {os.getpid()} ready")
 
-app = FastAPI(title="Research Paper Summarizer")
+    yield
+
+    # uvicorn has already waited up to SHUTDOWN_TIMEOUT for open streams; any left were cancelled
+    if JobTracker.active_jobs():
+        logger.warning(f"Worker {os.getpid()} stopped with {JobTracker.active_jobs()} processing job(s) cancelled")
+    else:
+        logger.info(f"Worker {os.getpid()} stopped")
+
+
+app = FastAPI(title="Research Paper Summarizer", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -23,6 +62,18 @@ app.add_middleware(
 def read_root():
     return {"Hello": "Research Paper Summarizer API"}
 
+@app.get("/health")
+def health():
+    """
+    Report this worker's in-flight processing jobs and LLM queue state.
+    """
+    return {
+        "pid": os.getpid(),
+        "draining": JobTracker.is_draining(),
+        "active_jobs": JobTracker.active_jobs(),
+        "llm": llm_rate_limiter.stats(),
+    }
+
 # Add your API endpoints here
 app.include_router(paper_endpoints.paper_router, prefix="/api/paper")
 app.include_router(summary_endpoints.summary_router, prefix="/api/summary")
@@ -30,4 +81,18 @@ app.include_router(summary_endpoints.summary_router, prefix="/api/summary")
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+    if workers > 1:
+        # Production mode: uvicorn needs an import string to spawn worker processes
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            workers=workers,
+            timeout_graceful_shutdown=SHUTDOWN_TIMEOUT,
+        )
+    else:
+        uvicorn.run(app, host=host, port=port, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
@@ -11,4 +11,12 @@ class Paper(Base):
     filename = Column(String, unique=True, index=True)
     file_path = Column(String)
     upload_date = Column(DateTime, default=datetime.now)
+    # Processing state: pending, processing, complete or failed
+    processing_status = Column(String, default="pending")
+    # Incremented by every processing run; a run only writes while it holds the latest version
+    processing_version = Column(Integer, default=0)
+    processing_started_at = Column(DateTime, nullable=True)
+    # Checkpoint: LLM section output and how many of those sections have been saved
+    sections_json = Column(Text, nullable=True)
+    sections_completed = Column(Integer, default=0)
     summaries = relationship("Summary", back_populates="paper")
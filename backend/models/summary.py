@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -16,3 +16,8 @@ class Summary(Base):
     page = Column(Integer, default=1)  # Page number where the section appears
     created_at = Column(DateTime, default=datetime.now)
     paper = relationship("Paper", back_populates="summaries")
+
+    __table_args__ = (
+        # One summary per section of a paper, so re-processing updates instead of duplicating
+        Index("uq_summaries_paper_section_page", "paper_id", "section_title", "page", unique=True),
+    )
@@ -0,0 +1,71 @@
+# services/job_tracker_service.py
+import signal
+import logging
+from contextlib import asynccontextmanager
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+class JobTracker:
+    """
+    Track the paper processing jobs running in this worker and whether it is shutting down.
+
+    Waiting for in-flight streams is done by uvicorn itself: on SIGINT/SIGTERM it stops
+    accepting connections and gives open responses up to `timeout_graceful_shutdown`
+    seconds to finish before cancelling them. The draining flag is set from that same
+    signal, before uvicorn stops serving, so new /process requests on connections that
+    are still open get a 503 and /health reports the worker as draining.
+    """
+
+    _active = 0
+    _draining = False
+
+    @classmethod
+    def active_jobs(cls) -> int:
+        return cls._active
+
+    @classmethod
+    def is_draining(cls) -> bool:
+        return cls._draining
+
+    @classmethod
+    def start_draining(cls):
+        if not cls._draining:
+            logger.info(f"Shutdown requested, draining {cls._active} in-flight processing job(s)")
+        cls._draining = True
+
+    @classmethod
+    def install_signal_handlers(cls):
+        """
+        Mark the worker as draining on SIGINT/SIGTERM, then hand the signal on to the
+        server's own handler. Only wraps handlers the server installed, so the default
+        behaviour is untouched when running outside uvicorn.
+        """
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                cls.start_draining()
+                previous(signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Signal handlers can only be set from the main thread
+                logger.warning("Could not install shutdown signal handlers outside the main thread")
+                return
+
+    @classmethod
+    @asynccontextmanager
+    async def track(cls):
+        """
+        Count a running job for the duration of the context.
+        """
+        cls._active += 1
+        try:
+            yield
+        finally:
+            cls._active -= 1
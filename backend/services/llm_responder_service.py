@@ -3,9 +3,16 @@ import os
 import logging
 import json
 import re
+import random
+import asyncio
 import pdfplumber
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from services.summary_service import SummaryService
+from services.paper_service import PaperService, LEASE_RENEW_SECONDS
+from database import SessionLocal
+from services.prompt_compactor_service import PromptCompactor
+from services.rate_limiter_service import llm_rate_limiter, QueueFullError
 
 
 logging.basicConfig(
@@ -19,8 +26,35 @@ logging.basicConfig(
 # Configure logger
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-lite'
+
+# Retries for rate-limited (429) or unavailable Gemini responses
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "2"))
+
+
 class LLMResponder:
 
+    _model = None
+    # Summary jobs in flight in this worker, and how many streams are waiting on each (by paper ID)
+    _summary_jobs = {}
+    _summary_waiters = {}
+
+    @staticmethod
+    def get_model():
+        """
+        Return the shared Gemini model client, configuring it on first use.
+        Called from the application startup hook so the first request doesn't pay for it.
+        """
+        if LLMResponder._model is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable not set")
+            
+            genai.configure(api_key=api_key)
+            LLMResponder._model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        return LLMResponder._model
+
     @staticmethod
     def extract_text_content_by_page(pdf_path, header_height_ratio=0.1, footer_height_ratio=0.1):
         """
@@ -102,29 +136,29 @@ class LLMResponder:
         return None
 
     @staticmethod
-    def summarize_research_paper(pdf_path):
+    def build_summary_prompt(pdf_path):
         """
-        Summarize a research paper using Gemini AI.
-        Returns a list of section summaries with titles and page numbers.
+        Build the summarization prompt for a research paper.
         """
-        # Initialize Gemini model
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable not set")
-        
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-lite')
-        
         # Extract content by page
         page_contents = LLMResponder.extract_text_content_by_page(pdf_path)
         
+        # Normalize the text, drop references/appendices and fit the token budget
+        page_contents, compaction = PromptCompactor.compact_pages(page_contents)
+        if compaction["dropped_pages"] or compaction["truncated_pages"]:
+            logger.info(
+                f"Compacted document for {pdf_path}: back matter from page {compaction['back_matter_page']}, "
+                f"dropped pages {compaction['dropped_pages']}, truncated pages {compaction['truncated_pages']}"
+            )
+        
         # Combine all pages into a single document with page markers
-        full_document = ""
-        for page_num in sorted(page_contents.keys()):
-            full_document += f"\n\n--- PAGE {page_num} ---\n\n"
-            full_document += page_contents[page_num]
+        full_document = PromptCompactor.assemble_document(page_contents)
         
-        logger.info(f"Sending complete document for summarization")
+        logger.info(
+            f"Sending complete document for summarization "
+            f"(estimated tokens: {compaction['tokens_before']} -> {compaction['tokens_after']}, "
+            f"budget: {compaction['token_budget']})"
+        )
         
         # Create a single prompt with all content
         prompt = f"""I want you to act as a research paper summarizer. Your task is to identify section titles and 
@@ -146,10 +180,50 @@ class LLMResponder:
             ...
         ]"""
         
+        return prompt
+
+    @staticmethod
+    async def generate_content(prompt, client_id):
+        """
+        Send a prompt to Gemini within the rate limiter's budgets.
+        Rate-limit (429) and unavailable (503) responses are retried with exponential
+        backoff, pausing every queued request so the quota can recover.
+        """
+        model = LLMResponder.get_model()
+        tokens = PromptCompactor.estimate_tokens(prompt)
+        
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with llm_rate_limiter.slot(client_id, tokens, retry=attempt > 0):
+                try:
+                    # generate_content blocks, keep it off the event loop
+                    return await asyncio.to_thread(model.generate_content, prompt)
+                except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                        google_exceptions.ServiceUnavailable) as e:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    delay = LLM_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+                    logger.warning(f"Gemini rate limited ({e.__class__.__name__}), retrying in {delay:.1f}s "
+                                   f"(attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+                    llm_rate_limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def summarize_research_paper(pdf_path, client_id="default"):
+        """
+        Summarize a research paper using Gemini AI.
+        Returns a list of section summaries with titles and page numbers.
+        """
+        prompt = await asyncio.to_thread(LLMResponder.build_summary_prompt, pdf_path)
+        
         # Send the prompt and get the response
-        response = model.generate_content(prompt)
+        response = await LLMResponder.generate_content(prompt, client_id)
         response_text = response.text
         
+        # Report the tokens actually billed for the request
+        usage = getattr(response, "usage_metadata", None)
+        tokens_in = getattr(usage, "prompt_token_count", None) or PromptCompactor.estimate_tokens(prompt)
+        logger.info(f"metric llm.tokens_in={tokens_in} pdf={pdf_path}")
+        
         # Try to parse JSON from the response using our robust extraction function
         summary = LLMResponder.extract_json_from_text(response_text)
         
@@ -160,45 +234,146 @@ class LLMResponder:
         return summary
 
     @staticmethod
-    async def process_paper_sections(db: Session, paper_id: int, file_path: str):
+    async def _run_summary_job(paper_id: int, file_path: str, client_id: str):
+        """
+        Call the LLM for a paper and checkpoint the result.
+        Runs as its own task so a client disconnect can't cancel a call we pay for;
+        the lease is renewed meanwhile so no retry takes the paper over. If no stream
+        is waiting when the job ends, the paper is released for a retry to resume.
+        """
+        db = SessionLocal()
+        try:
+            summary_task = asyncio.ensure_future(LLMResponder.summarize_research_paper(file_path, client_id))
+            while True:
+                done, _ = await asyncio.wait({summary_task}, timeout=LEASE_RENEW_SECONDS)
+                if done:
+                    break
+                PaperService.renew_lease(db, paper_id)
+            summaries = summary_task.result()
+            
+            # Checkpoint the LLM output so retries don't pay for it again
+            if isinstance(summaries, list):
+                summaries = [section for section in summaries if isinstance(section, dict)]
+                PaperService.store_sections(db, paper_id, json.dumps(summaries))
+            return summaries
+        finally:
+            LLMResponder._summary_jobs.pop(paper_id, None)
+            if not LLMResponder._summary_waiters.get(paper_id):
+                try:
+                    PaperService.release_processing(db, paper_id)
+                except Exception as e:
+                    logger.error(str(e))
+            db.close()
+
+    @staticmethod
+    async def summarize_with_checkpoint(paper_id: int, file_path: str, client_id: str):
+        """
+        Start (or join) the summary job for a paper and wait for its result.
+        Cancelling the caller only stops the wait, not the LLM call or its checkpoint.
+        """
+        job = LLMResponder._summary_jobs.get(paper_id)
+        if job is None:
+            job = asyncio.ensure_future(LLMResponder._run_summary_job(paper_id, file_path, client_id))
+            LLMResponder._summary_jobs[paper_id] = job
+        
+        LLMResponder._summary_waiters[paper_id] = LLMResponder._summary_waiters.get(paper_id, 0) + 1
+        try:
+            return await asyncio.shield(job)
+        finally:
+            LLMResponder._summary_waiters[paper_id] -= 1
+            if not LLMResponder._summary_waiters[paper_id]:
+                del LLMResponder._summary_waiters[paper_id]
+
+    @staticmethod
+    def parse_page_number(value) -> int:
+        """
+        Parse the page number the LLM returned ("3", 3, "3-4", "p. 5"), falling back to 1.
+        """
+        if isinstance(value, int):
+            return value if value > 0 else 1
+        match = re.search(r"\d+", str(value or ""))
+        return int(match.group(0)) if match and int(match.group(0)) > 0 else 1
+
+    @staticmethod
+    async def process_paper_sections(db: Session, paper_id: int, file_path: str,
+                                     client_id: str = "default", reprocess: bool = False):
         """
         Process the paper sections and save them to the database.
         This function is called after the paper is uploaded and processed.
         Returns a streaming response of summaries as they're generated.
         
+        The paper is claimed on the first step, so only one run processes it at a time.
+        Progress is checkpointed on the paper, so a retried run reuses the stored LLM
+        output and only saves the sections the previous run didn't get to.
+        With `reprocess`, the checkpoint and existing summaries are discarded first.
+        
         Yields:
-        - JSON strings with status updates and section summaries
+        - dicts with status updates and section summaries (serialized by ProgressStreamEncoder)
         """
+        finished = False
+        version = None
         try:
             
+            # Only one run per paper at a time; the claim is released in the finally below
+            version = PaperService.claim_processing(db, paper_id)
+            if version is None:
+                yield {"status": "error", "message": "Paper is already being processed"}
+                return
+            
             # Yield initial status
-            yield json.dumps({"status": "processing", "message": "Starting paper processing"})
+            yield {"status": "processing", "message": "Starting paper processing"}
+            
+            if reprocess:
+                PaperService.reset_checkpoint(db, paper_id, version)
+                SummaryService.delete_paper_summaries(db, paper_id)
             
-            summaries = LLMResponder.summarize_research_paper(file_path)
+            paper = PaperService.get_paper(db, paper_id=paper_id)
+            
+            if paper.sections_json:
+                summaries = json.loads(paper.sections_json)
+                completed = paper.sections_completed or 0
+                logger.info(f"Resuming paper ID {paper_id} from checkpoint ({completed}/{len(summaries)} sections saved)")
+                yield {"status": "processing", "message": "Resuming from previous run"}
+            else:
+                try:
+                    summaries = await LLMResponder.summarize_with_checkpoint(paper_id, file_path, client_id)
+                except QueueFullError as e:
+                    yield {"status": "error", "message": str(e), "retry_after": e.retry_after}
+                    return
+                completed = 0
             
             # Check if we got valid summaries
             if isinstance(summaries, list):
-                yield json.dumps({"status": "processing", "message": f"Found {len(summaries)} sections"})
+                yield {"status": "processing", "message": f"Found {len(summaries)} sections"}
+                
+                # The checkpoint only advances over sections that were all saved successfully
+                checkpoint_blocked = False
                 
                 # Save each section summary
                 for i, section in enumerate(summaries):
+                    section_title = section.get("Section Title", "Untitled Section")
                     try:
-                        section_title = section.get("Section Title", "Untitled Section")
                         summary_text = section.get("Summary", "")
-                        page = section.get("page_no", 1)
+                        page = LLMResponder.parse_page_number(section.get("page_no"))
                         
-                        # Save the section summary
-                        SummaryService.save_summary(
-                            session=db,
-                            paper_id=paper_id,
-                            section_title=section_title,
-                            summary_text=summary_text,
-                            page=page
-                        )
+                        # Sections saved by an earlier run are only replayed to the client
+                        if i >= completed:
+                            SummaryService.save_summary(
+                                session=db,
+                                paper_id=paper_id,
+                                section_title=section_title,
+                                summary_text=summary_text,
+                                page=page
+                            )
+                            if not checkpoint_blocked and not PaperService.save_checkpoint(
+                                db, paper_id, version, sections_completed=i + 1
+                            ):
+                                yield {"status": "error", "message": "Paper is being processed by another request"}
+                                return
                         
                         # Yield progress update
                         progress = int((i + 1) / len(summaries) * 100)
-                        yield json.dumps({
+                        yield {
                             "status": "saving", 
                             "message": f"Saved summary for {section_title}",
                             "progress": progress,
@@ -207,22 +382,43 @@ class LLMResponder:
                                 "summary": summary_text,
                                 "page": page
                             }
-                        })
+                        }
                         
                     except Exception as e:
+                        checkpoint_blocked = True
                         logger.error(f"Error saving section {section_title}: {str(e)}")
-                        yield json.dumps({"status": "error", "message": f"Error saving section {section_title}: {str(e)}"})
+                        yield {"status": "error", "message": f"Error saving section {section_title}: {str(e)}"}
+                
+                if checkpoint_blocked:
+                    PaperService.finish_processing(db, paper_id, version, "failed")
+                    finished = True
+                    yield {"status": "error", "message": "Some sections could not be saved, retry to resume or reprocess the paper"}
+                    return
+                
+                PaperService.finish_processing(db, paper_id, version, "complete")
+                finished = True
                 
                 # Yield completion message
-                yield json.dumps({"status": "complete", "message": "All summaries processed successfully"})
+                yield {"status": "complete", "message": "All summaries processed successfully"}
             else:
+                PaperService.finish_processing(db, paper_id, version, "failed")
+                finished = True
                 error_msg = f"Failed to generate summaries: {summaries}"
                 logger.error(error_msg)
-                yield json.dumps({"status": "error", "message": error_msg})
+                yield {"status": "error", "message": error_msg}
                 
             logger.info(f"Completed processing for paper ID: {paper_id}")
         except Exception as e:
             error_msg = f"Error in process_paper_sections for paper ID {paper_id}: {str(e)}"
             logger.error(error_msg)
-            yield json.dumps({"status": "error", "message": error_msg})
-
+            yield {"status": "error", "message": error_msg}
+        finally:
+            # Release the paper if the run stopped early (error or client disconnect),
+            # so a retry can resume right away instead of waiting for the lease to expire
+            # While a summary job is still running it holds the lease and releases the paper itself
+            job_running = paper_id in LLMResponder._summary_jobs
+            if not finished and version is not None and not job_running:
+                try:
+                    PaperService.finish_processing(db, paper_id, version, "failed")
+                except Exception as status_error:
+                    logger.error(str(status_error))
@@ -1,8 +1,17 @@
 # services/paperservice.py
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
 from sqlalchemy.orm import Session
 from models.paper import Paper
 from typing import List, Optional
 
+# A run that hasn't checkpointed for this long is considered dead and can be taken over
+PROCESSING_LEASE_SECONDS = int(os.getenv("PROCESSING_LEASE_SECONDS", "600"))
+
+# How often a run renews its lease while waiting on the LLM
+LEASE_RENEW_SECONDS = max(1, PROCESSING_LEASE_SECONDS // 3)
+
 
 class PaperService:
     @staticmethod
@@ -45,3 +54,169 @@ class PaperService:
             return db.query(Paper).filter(Paper.id == paper_id).first()
         except Exception as e:
             raise Exception(f"Error retrieving paper with ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def get_paper_by_filename(db: Session, filename: str) -> Optional[Paper]:
+        """
+        Get a paper by its uploaded file name
+
+        """
+        try:
+            return db.query(Paper).filter(Paper.filename == filename).first()
+        except Exception as e:
+            raise Exception(f"Error retrieving paper {filename}: {str(e)}")
+
+    @staticmethod
+    def is_processing(paper: Paper) -> bool:
+        """
+        Whether a live run (one that has checkpointed within the lease) holds the paper.
+        """
+        if paper.processing_status != "processing" or paper.processing_started_at is None:
+            return False
+        return paper.processing_started_at >= datetime.now() - timedelta(seconds=PROCESSING_LEASE_SECONDS)
+
+    @staticmethod
+    def claim_processing(db: Session, paper_id: int) -> Optional[int]:
+        """
+        Start a processing run for a paper.
+        Returns the run's processing version, or None if another live run holds the paper.
+        """
+        try:
+            now = datetime.now()
+            stale_before = now - timedelta(seconds=PROCESSING_LEASE_SECONDS)
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                or_(
+                    Paper.processing_status.is_(None),
+                    Paper.processing_status != "processing",
+                    Paper.processing_started_at.is_(None),
+                    Paper.processing_started_at < stale_before,
+                )
+            ).values(
+                processing_status="processing",
+                processing_version=Paper.processing_version + 1,
+                processing_started_at=now
+            )
+            result = db.execute(stmt)
+            db.commit()
+            if result.rowcount == 0:
+                return None
+
+            return db.query(Paper.processing_version).filter(Paper.id == paper_id).scalar()
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error claiming paper ID {paper_id} for processing: {str(e)}")
+
+    @staticmethod
+    def save_checkpoint(db: Session, paper_id: int, version: int,
+                        sections_json: str = None, sections_completed: int = None) -> bool:
+        """
+        Record processing progress for the run holding `version`.
+        Also renews the run's lease. Returns False if a newer run has taken over the paper.
+        """
+        try:
+            values = {"processing_started_at": datetime.now()}
+            if sections_json is not None:
+                values["sections_json"] = sections_json
+            if sections_completed is not None:
+                values["sections_completed"] = sections_completed
+
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.processing_version == version
+            ).values(**values)
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error saving checkpoint for paper ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def finish_processing(db: Session, paper_id: int, version: int, status: str) -> bool:
+        """
+        Mark the run holding `version` as complete or failed.
+        The checkpoint is kept, so a failed run can be resumed without new LLM calls.
+        """
+        try:
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.processing_version == version
+            ).values(processing_status=status)
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error updating processing status for paper ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def reset_checkpoint(db: Session, paper_id: int, version: int) -> bool:
+        """
+        Discard the stored LLM output and progress so the next step calls the LLM again.
+        Returns False if a newer run has taken over the paper.
+        """
+        try:
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.processing_version == version
+            ).values(sections_json=None, sections_completed=0)
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error resetting checkpoint for paper ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def renew_lease(db: Session, paper_id: int) -> bool:
+        """
+        Keep the current run's lease alive while work for the paper is still in flight.
+        Returns False if the paper is no longer being processed.
+        """
+        try:
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.processing_status == "processing"
+            ).values(processing_started_at=datetime.now())
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error renewing lease for paper ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def store_sections(db: Session, paper_id: int, sections_json: str) -> bool:
+        """
+        Checkpoint paid LLM output for a paper unless a checkpoint already exists.
+        Not fenced by version: output from a run that lost its stream is still worth keeping.
+        """
+        try:
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.sections_json.is_(None)
+            ).values(sections_json=sections_json, sections_completed=0)
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error saving checkpoint for paper ID {paper_id}: {str(e)}")
+
+    @staticmethod
+    def release_processing(db: Session, paper_id: int) -> bool:
+        """
+        Mark a paper whose run has no client left as failed, so a retry can resume it.
+        """
+        try:
+            stmt = update(Paper).where(
+                Paper.id == paper_id,
+                Paper.processing_status == "processing"
+            ).values(processing_status="failed")
+            result = db.execute(stmt)
+            db.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            db.rollback()
+            raise Exception(f"Error releasing paper ID {paper_id}: {str(e)}")
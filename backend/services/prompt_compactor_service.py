@@ -0,0 +1,202 @@
+# services/prompt_compactor_service.py
+import os
+import re
+import logging
+import unicodedata
+from typing import Dict, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English prose with Gemini tokenizers.
+# Used for budgeting so we don't pay a count_tokens round trip before every call.
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TOKEN_BUDGET = 100000
+
+# Marker placed before each page of the document sent to the LLM
+PAGE_MARKER = "\n\n--- PAGE {page_num} ---\n\n"
+
+# Headings that mark the start of back matter (references, appendices, ...)
+BACK_MATTER_PATTERN = re.compile(
+    r"^[ \t]*(?:[A-Z]\.|\d+\.?|[IVX]+\.)?[ \t]*"
+    r"(?:(?:references|bibliography|works cited|literature cited)[ \t]*:?"
+    r"|(?:appendix|appendices|supplementary (?:material|information))"
+    r"(?:[ \t]+[A-Z0-9]{1,3})?(?:[ \t]*[:.][^\n]*)?)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Word broken with a hyphen at the end of a line: ("state-of-the", "art")
+LINE_BREAK_HYPHEN_PATTERN = re.compile(r"(\S+)-\n(\S)")
+
+# Prefixes that form hyphenated compounds; a line-end hyphen after them is a real hyphen
+COMPOUND_PREFIXES = {
+    "anti", "co", "cross", "data", "end", "high", "large", "long", "low", "multi",
+    "non", "post", "pre", "real", "self", "semi", "short", "small", "state", "well",
+}
+
+
+class PromptCompactor:
+
+    @staticmethod
+    def get_token_budget() -> int:
+        """
+        Read the maximum number of document tokens to send from PROMPT_TOKEN_BUDGET.
+        """
+        value = os.getenv("PROMPT_TOKEN_BUDGET")
+        if not value:
+            return DEFAULT_TOKEN_BUDGET
+        try:
+            budget = int(value)
+        except ValueError:
+            logger.warning(f"Invalid PROMPT_TOKEN_BUDGET '{value}', using {DEFAULT_TOKEN_BUDGET}")
+            return DEFAULT_TOKEN_BUDGET
+        return budget if budget > 0 else DEFAULT_TOKEN_BUDGET
+
+    @staticmethod
+    def drop_back_matter_enabled() -> bool:
+        """
+        Whether bibliography/appendix pages should be dropped (PROMPT_DROP_BACK_MATTER).
+        """
+        return os.getenv("PROMPT_DROP_BACK_MATTER", "true").strip().lower() in ("1", "true", "yes", "on")
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        Estimate the number of tokens in a piece of text.
+        """
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Normalize extracted PDF text: unfold ligatures, rejoin words hyphenated
+        across line breaks, and collapse repeated whitespace.
+        """
+        text = unicodedata.normalize("NFKC", text)
+        # Drop soft hyphens and zero-width characters left behind by PDF extraction
+        text = re.sub("[\u00ad\u200b\u200c\u200d\ufeff]", "", text)
+        text = LINE_BREAK_HYPHEN_PATTERN.sub(PromptCompactor._join_line_break_hyphen, text)
+        # Collapse runs of spaces/tabs and trim each line
+        text = re.sub(r"[ \t]+", " ", text)
+        text = re.sub(r" ?\n ?", "\n", text)
+        # At most one blank line between paragraphs
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip()
+
+    @staticmethod
+    def _join_line_break_hyphen(match) -> str:
+        """
+        Rejoin a word hyphenated across a line break ("exam-\nple" -> "example").
+        Compounds ("state-of-the-\nart", "self-\nsupervised") keep their hyphen,
+        and anything that isn't lowercase on both sides is left untouched.
+        """
+        word, next_char = match.group(1), match.group(2)
+        if not (word[-1].islower() and next_char.islower()):
+            return match.group(0)
+        if "-" in word or word.lower() in COMPOUND_PREFIXES:
+            return f"{word}-{next_char}"
+        return f"{word}{next_char}"
+
+    @staticmethod
+    def find_back_matter_start(page_contents: Dict[int, str]) -> Tuple[int, int]:
+        """
+        Find where the back matter (references, appendices) begins.
+        Only headings in the second half of the document are considered, so a
+        "References" mention in the introduction is not mistaken for the bibliography.
+        Returns (page_num, char_offset) or (None, None) if nothing was detected.
+        """
+        pages = sorted(page_contents.keys())
+        if len(pages) < 2:
+            return None, None
+
+        for page_num in pages[len(pages) // 2:]:
+            match = BACK_MATTER_PATTERN.search(page_contents[page_num])
+            if match:
+                return page_num, match.start()
+        return None, None
+
+    @staticmethod
+    def assemble_document(pages: Dict[int, str]) -> str:
+        """
+        Combine pages into a single document with page markers, as sent to the LLM.
+        """
+        return "".join(PAGE_MARKER.format(page_num=page_num) + pages[page_num] for page_num in sorted(pages))
+
+    @staticmethod
+    def _markers_length(pages: Dict[int, str]) -> int:
+        return sum(len(PAGE_MARKER.format(page_num=page_num)) for page_num in pages)
+
+    @staticmethod
+    def compact_pages(page_contents: Dict[int, str], token_budget: int = None,
+                      drop_back_matter: bool = None) -> Tuple[Dict[int, str], dict]:
+        """
+        Normalize page texts, optionally drop back matter, and trim the result so the
+        assembled document (see assemble_document) fits the token budget.
+        Returns the compacted pages and a report describing what was trimmed.
+        """
+        if token_budget is None:
+            token_budget = PromptCompactor.get_token_budget()
+        if drop_back_matter is None:
+            drop_back_matter = PromptCompactor.drop_back_matter_enabled()
+
+        report = {
+            "tokens_before": PromptCompactor.estimate_tokens(PromptCompactor.assemble_document(page_contents)),
+            "token_budget": token_budget,
+            "dropped_pages": [],
+            "back_matter_page": None,
+            "truncated_pages": [],
+        }
+
+        pages = {}
+        for page_num in sorted(page_contents.keys()):
+            text = PromptCompactor.normalize_text(page_contents[page_num])
+            if text:
+                pages[page_num] = text
+
+        # Drop references/appendices
+        if drop_back_matter:
+            start_page, offset = PromptCompactor.find_back_matter_start(pages)
+            if start_page is not None:
+                report["back_matter_page"] = start_page
+                for page_num in list(pages.keys()):
+                    if page_num > start_page:
+                        report["dropped_pages"].append(page_num)
+                        del pages[page_num]
+                remaining = pages[start_page][:offset].strip()
+                if remaining:
+                    pages[start_page] = remaining
+                else:
+                    report["dropped_pages"].insert(0, start_page)
+                    del pages[start_page]
+
+        # Enforce the token budget on the assembled document, page markers included.
+        # Every page is trimmed proportionally so each page keeps its opening text;
+        # headings further down a trimmed page are lost.
+        if PromptCompactor.estimate_tokens(PromptCompactor.assemble_document(pages)) > token_budget:
+            budget_chars = token_budget * CHARS_PER_TOKEN
+
+            # The markers must fit first: drop pages from the end until they leave room for text
+            while pages and PromptCompactor._markers_length(pages) >= budget_chars:
+                last_page = max(pages)
+                del pages[last_page]
+                report["dropped_pages"].append(last_page)
+
+            available_chars = budget_chars - PromptCompactor._markers_length(pages)
+            text_chars = sum(len(text) for text in pages.values())
+            for page_num, text in list(pages.items()):
+                keep_chars = len(text) * available_chars // text_chars
+                if keep_chars >= len(text):
+                    continue
+                trimmed = text[:keep_chars].rstrip()
+                if trimmed:
+                    pages[page_num] = trimmed
+                    report["truncated_pages"].append(page_num)
+                else:
+                    # Nothing left worth a page marker
+                    del pages[page_num]
+                    report["dropped_pages"].append(page_num)
+            report["dropped_pages"].sort()
+
+        report["tokens_after"] = PromptCompactor.estimate_tokens(PromptCompactor.assemble_document(pages))
+        return pages, report
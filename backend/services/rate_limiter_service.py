@@ -0,0 +1,230 @@
+# services/rate_limiter_service.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+def _env_number(name: str, default: float) -> float:
+    """
+    Read a positive number from the environment, falling back to `default`.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        logger.warning(f"Invalid {name} '{value}', using {default}")
+        return default
+    if number <= 0:
+        logger.warning(f"{name} must be positive, got '{value}', using {default}")
+        return default
+    return number
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the LLM request queue is full. `retry_after` is a suggested wait in seconds.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM request queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens, refilled continuously
+    at `capacity` tokens per minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` tokens are available (0 if they are available now).
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMRateLimiter:
+    """
+    Concurrency governor and RPM/TPM limiter for Gemini calls in this worker process.
+
+    Requests wait in one FIFO queue per client; clients are served round-robin so a
+    single client sending a burst can't starve the others. Budgets are configured for
+    the whole deployment and split evenly across WEB_CONCURRENCY worker processes.
+    """
+
+    def __init__(self, max_concurrency: int, rpm: float, tpm: float, max_queue: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.active = 0
+        self.queues = OrderedDict()
+        self.paused_until = 0.0
+        self._wakeup = None
+
+    @classmethod
+    def from_env(cls) -> "LLMRateLimiter":
+        """
+        Build the limiter from LLM_MAX_CONCURRENCY, LLM_RPM, LLM_TPM and LLM_MAX_QUEUE.
+        Every worker needs at least one concurrency slot and one queue place, so with
+        more workers than the configured value the effective cap is one per worker.
+        """
+        workers = max(1, int(_env_number("WEB_CONCURRENCY", 1)))
+        max_concurrency = int(_env_number("LLM_MAX_CONCURRENCY", 4))
+        max_queue = int(_env_number("LLM_MAX_QUEUE", 50))
+        for name, value in (("LLM_MAX_CONCURRENCY", max_concurrency), ("LLM_MAX_QUEUE", max_queue)):
+            if value < workers:
+                logger.warning(
+                    f"{name}={value} is lower than WEB_CONCURRENCY={workers}; "
+                    f"each worker gets 1, allowing up to {workers} in total"
+                )
+        return cls(
+            max_concurrency=max(1, max_concurrency // workers),
+            rpm=_env_number("LLM_RPM", 30) / workers,
+            tpm=_env_number("LLM_TPM", 1000000) / workers,
+            max_queue=max(1, max_queue // workers),
+        )
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def retry_after(self) -> int:
+        """
+        Rough number of seconds before a new request could be accepted.
+        """
+        per_request = 60.0 / self.requests.capacity
+        pause = max(0.0, self.paused_until - time.monotonic())
+        return max(1, int(pause + per_request * (self.queue_depth() + 1)))
+
+    def is_full(self) -> bool:
+        return self.queue_depth() >= self.max_queue
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queue_depth(),
+            "clients_waiting": len(self.queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    def pause(self, seconds: float):
+        """
+        Stop dispatching for `seconds`, e.g. after the API answered 429.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.requests.tokens = 0
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, tokens: int, retry: bool = False):
+        """
+        Wait for a fair turn within the concurrency and rate budgets, then hold a
+        concurrency slot for the duration of the context.
+        Raises QueueFullError if the queue is already full, unless `retry` is set:
+        retries of an admitted request skip that check and go to the front of the
+        client's queue, so they keep their place.
+        """
+        if not retry and self.is_full():
+            logger.warning(f"metric llm.queue_rejected=1 client={client_id} queue_depth={self.queue_depth()}")
+            raise QueueFullError(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(client_id, deque())
+        if retry:
+            queue.appendleft((waiter, tokens))
+        else:
+            queue.append((waiter, tokens))
+        logger.info(f"metric llm.queue_depth={self.queue_depth()} active={self.active} client={client_id}")
+        queued_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            self._discard(client_id, waiter)
+            raise
+
+        logger.info(f"metric llm.queue_wait_seconds={time.monotonic() - queued_at:.2f} client={client_id}")
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._dispatch()
+
+    def _discard(self, client_id: str, waiter):
+        if waiter.done() and not waiter.cancelled():
+            # The slot was granted just before cancellation; hand it back
+            self.active -= 1
+        queue = self.queues.get(client_id)
+        if queue:
+            for item in list(queue):
+                if item[0] is waiter:
+                    queue.remove(item)
+            if not queue:
+                del self.queues[client_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Grant slots to waiting requests, round-robin across clients, while the
+        concurrency and rate budgets allow.
+        """
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self.queues and self.active < self.max_concurrency:
+            client_id, queue = next(iter(self.queues.items()))
+            waiter, tokens = queue[0]
+
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens),
+            )
+            if wait > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            queue.popleft()
+            # Move the client to the back so other clients get the next turn
+            del self.queues[client_id]
+            if queue:
+                self.queues[client_id] = queue
+
+            if waiter.done():
+                continue
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.active += 1
+            waiter.set_result(None)
+
+
+llm_rate_limiter = LLMRateLimiter.from_env()
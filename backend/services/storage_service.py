@@ -0,0 +1,109 @@
+# services/storage_service.py
+import os
+import shutil
+import logging
+from functools import lru_cache
+from typing import BinaryIO
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+class LocalStorage:
+    """
+    Store uploads in a directory relative to the working directory of the process.
+    Suitable for a single node; every worker on the node shares the directory.
+    """
+
+    def __init__(self, upload_dir: str = "uploads"):
+        self.upload_dir = upload_dir
+
+    def path_for(self, filename: str) -> str:
+        """
+        Resolve the storage path for an uploaded filename.
+        """
+        # Never let a client-supplied name escape the upload directory
+        return os.path.join(self.upload_dir, os.path.basename(filename))
+
+    def save(self, filename: str, fileobj: BinaryIO) -> str:
+        """
+        Save an uploaded file and return the path recorded in the database.
+        An existing file is never replaced: the file is created exclusively and
+        FileExistsError is raised if the name is already taken, on this node or
+        (for shared storage) any other.
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        file_path = self.path_for(filename)
+        with open(file_path, "xb") as buffer:
+            try:
+                shutil.copyfileobj(fileobj, buffer)
+                buffer.flush()
+                os.fsync(buffer.fileno())
+            except Exception:
+                buffer.close()
+                os.remove(file_path)
+                raise
+        return file_path
+
+    def delete(self, file_path: str):
+        """
+        Remove a stored file, e.g. when its database row could not be saved.
+        """
+        path = self.resolve(file_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def exists(self, file_path: str) -> bool:
+        """
+        Check whether a stored file is available.
+        """
+        return os.path.exists(self.resolve(file_path))
+
+    def resolve(self, file_path: str) -> str:
+        """
+        Map a stored path to a local filesystem path that can be opened.
+        """
+        return file_path
+
+
+class SharedPathStorage(LocalStorage):
+    """
+    Store uploads on a path shared by every node (NFS, EFS, SMB mount, ...).
+    Paths are recorded relative to the shared root, so nodes that mount the
+    share at different locations still resolve the same file.
+    """
+
+    def __init__(self, root: str):
+        super().__init__(upload_dir=root)
+
+    def save(self, filename: str, fileobj: BinaryIO) -> str:
+        super().save(filename, fileobj)
+        return os.path.basename(filename)
+
+    def resolve(self, file_path: str) -> str:
+        # Rows written before the shared backend was enabled hold local paths
+        # ("uploads/<name>" or absolute); shared rows are a bare file name
+        if os.path.isabs(file_path) or os.path.dirname(file_path):
+            return file_path
+        return self.path_for(file_path)
+
+
+@lru_cache(maxsize=None)
+def get_storage():
+    """
+    Build the upload storage backend configured through the environment.
+
+    UPLOAD_STORAGE: "local" (default) or "shared"
+    UPLOAD_DIR: upload directory for local storage (default "uploads")
+    SHARED_UPLOAD_PATH: mount point of the shared directory for shared storage
+    """
+    backend = os.getenv("UPLOAD_STORAGE", "local").strip().lower()
+    if backend == "shared":
+        root = os.getenv("SHARED_UPLOAD_PATH")
+        if not root:
+            raise ValueError("SHARED_UPLOAD_PATH environment variable not set")
+        return SharedPathStorage(root)
+    if backend != "local":
+        raise ValueError(f"Unknown UPLOAD_STORAGE backend: {backend}")
+    return LocalStorage(os.getenv("UPLOAD_DIR", "uploads"))
+
@@ -0,0 +1,219 @@
+# services/stream_encoder_service.py
+import json
+import time
+import zlib
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is used instead
+    brotli = None
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Short keys used by the compact event schema
+COMPACT_KEYS = {
+    "status": "s",
+    "message": "m",
+    "progress": "p",
+    "retry_after": "r",
+}
+
+# Statuses that end a stream; they are always sent out immediately
+TERMINAL_STATUSES = ("complete", "error")
+
+
+class StreamCompressor:
+    """
+    Incremental compressor for a streaming response body.
+    write() buffers data, flush() returns everything written so far in a form the
+    client can decode immediately, finish() ends the stream.
+    """
+
+    def __init__(self, encoding: str = "identity"):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._compressor = brotli.Compressor()
+        else:
+            self._compressor = None
+
+    def write(self, data: bytes) -> bytes:
+        if self._compressor is None:
+            return data
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        if self._compressor is None:
+            return b""
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._compressor is None:
+            return b""
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ProgressStreamEncoder:
+    """
+    Turn processing updates into an NDJSON response body.
+
+    - coalesce_window: "saving" updates arriving within this many seconds are sent
+      as one event carrying a "sections" list (0 sends every update on its own)
+    - compact: use the compact schema, e.g.
+      {"s":"saving","p":40,"x":[["1. Introduction","Summary...",1]]}
+    - encoding: "identity", "gzip" or "br"
+    - flush_interval: maximum seconds compressed output is held back before flushing
+    """
+
+    def __init__(self, encoding: str = "identity", compact: bool = False,
+                 coalesce_window: float = 0.0, flush_interval: float = 0.5):
+        self.compressor = StreamCompressor(encoding)
+        self.compact = compact
+        self.coalesce_window = max(0.0, coalesce_window)
+        self.flush_interval = max(0.0, flush_interval)
+
+    @staticmethod
+    def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+        """
+        Pick the best supported content encoding from an Accept-Encoding header.
+        """
+        accepted = set()
+        for part in (accept_encoding or "").split(","):
+            name, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            accepted.add(name.strip().lower())
+
+        if "br" in accepted and brotli is not None:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return "identity"
+
+    def coalesce(self, updates: List[dict]) -> dict:
+        """
+        Merge buffered "saving" updates into a single event.
+        """
+        if len(updates) == 1:
+            return updates[0]
+        return {
+            "status": "saving",
+            "message": f"Saved {len(updates)} sections",
+            "progress": updates[-1].get("progress"),
+            "sections": [update["section"] for update in updates],
+        }
+
+    def serialize(self, event: dict) -> bytes:
+        """
+        Serialize one event as an NDJSON line.
+        """
+        if not self.compact:
+            return (json.dumps(event) + "\n").encode("utf-8")
+
+        sections = event.get("sections")
+        if sections is None and "section" in event:
+            sections = [event["section"]]
+
+        compact_event = {}
+        for key, value in event.items():
+            if key in ("section", "sections"):
+                continue
+            # Saving events are described by their sections, the message is redundant
+            if key == "message" and sections is not None:
+                continue
+            compact_event[COMPACT_KEYS.get(key, key)] = value
+        if sections is not None:
+            compact_event["x"] = [[s["title"], s["summary"], s["page"]] for s in sections]
+        return (json.dumps(compact_event, separators=(",", ":")) + "\n").encode("utf-8")
+
+    async def stream(self, updates: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+        """
+        Encode an async iterator of update dicts into response body chunks.
+        """
+        buffered = []
+        buffer_deadline = None
+        flush_deadline = None
+        pending = None
+        events_in = events_out = bytes_out = 0
+
+        def emit(event: dict) -> bytes:
+            nonlocal events_out, flush_deadline
+            events_out += 1
+            if flush_deadline is None and self.compressor.encoding != "identity":
+                flush_deadline = time.monotonic() + self.flush_interval
+            return self.compressor.write(self.serialize(event))
+
+        try:
+            while True:
+                now = time.monotonic()
+                deadlines = [d for d in (buffer_deadline, flush_deadline) if d is not None]
+                timeout = max(0.0, min(deadlines) - now) if deadlines else None
+
+                if pending is None:
+                    pending = asyncio.ensure_future(updates.__anext__())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+                out = b""
+                update = None
+                finished = False
+                if done:
+                    try:
+                        update = pending.result()
+                        events_in += 1
+                    except StopAsyncIteration:
+                        finished = True
+                    pending = None
+
+                is_saving = update is not None and update.get("status") == "saving" and "section" in update
+                if is_saving and self.coalesce_window > 0:
+                    buffered.append(update)
+                    if buffer_deadline is None:
+                        buffer_deadline = time.monotonic() + self.coalesce_window
+
+                now = time.monotonic()
+                # Send buffered sections once the window closes or anything else needs to go out
+                if buffered and (finished or (update is not None and not is_saving)
+                                 or (buffer_deadline is not None and now >= buffer_deadline)):
+                    out += emit(self.coalesce(buffered))
+                    buffered = []
+                    buffer_deadline = None
+
+                if update is not None and not (is_saving and self.coalesce_window > 0):
+                    out += emit(update)
+
+                if finished:
+                    out += self.compressor.finish()
+                elif flush_deadline is not None and (
+                    now >= flush_deadline or (update is not None and update.get("status") in TERMINAL_STATUSES)
+                ):
+                    out += self.compressor.flush()
+                    flush_deadline = None
+
+                if out:
+                    bytes_out += len(out)
+                    yield out
+                if finished:
+                    break
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+            await updates.aclose()
+            logger.info(
+                f"metric stream.events_in={events_in} events_out={events_out} bytes_out={bytes_out} "
+                f"encoding={self.compressor.encoding}"
+            )
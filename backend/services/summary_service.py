@@ -1,6 +1,7 @@
 # services/summaryservice.py
 from typing import List
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from models.summary import Summary
 from sqlalchemy.orm import Session
 
@@ -9,19 +10,32 @@ class SummaryService:
     def save_summary(session: Session, paper_id: int, section_title: str,
                     summary_text: str, page: int = 1) -> Summary:
         """
-        Save a summary to the database
-       
+        Save a summary to the database.
+        Upserts on (paper_id, section_title, page), so saving the same section
+        again updates the existing row instead of adding a duplicate.
         """
         try:
-            # Create and save the summary
-            summary = Summary(
-                paper_id=paper_id,
-                section_title=section_title,
-                summary_text=summary_text,
-                page=page
-            )
-            session.add(summary)
-            session.commit()
+            summary = SummaryService._find_summary(session, paper_id, section_title, page)
+            if summary is None:
+                summary = Summary(
+                    paper_id=paper_id,
+                    section_title=section_title,
+                    summary_text=summary_text,
+                    page=page
+                )
+                session.add(summary)
+            else:
+                summary.summary_text = summary_text
+
+            try:
+                session.commit()
+            except IntegrityError:
+                # Another run inserted the same section concurrently; update that row instead
+                session.rollback()
+                summary = SummaryService._find_summary(session, paper_id, section_title, page)
+                summary.summary_text = summary_text
+                session.commit()
+
             session.refresh(summary)
             return summary
             
@@ -30,6 +44,27 @@ class SummaryService:
             session.rollback()
             raise Exception(f"Error saving summary for paper ID {paper_id}: {str(e)}")
 
+    @staticmethod
+    def _find_summary(session: Session, paper_id: int, section_title: str, page: int):
+        return session.query(Summary).filter(
+            Summary.paper_id == paper_id,
+            Summary.section_title == section_title,
+            Summary.page == page
+        ).first()
+
+
+    @staticmethod
+    def delete_paper_summaries(session: Session, paper_id: int) -> int:
+        """
+        Delete all summaries of a paper, returning how many were removed
+        """
+        try:
+            deleted = session.query(Summary).filter(Summary.paper_id == paper_id).delete()
+            session.commit()
+            return deleted
+        except Exception as e:
+            session.rollback()
+            raise Exception(f"Error deleting summaries for paper ID {paper_id}: {str(e)}")
 
     @staticmethod
     def get_paper_summaries(db: Session, paper_id: int) -> List[dict]:
@@ -78,7 +78,8 @@ function App() {
     
     try {
       // Use fetch with streaming response
-      const response = await fetch(`${API_URL}/paper/${paper.id}/process`);
+      // Sections saved close together arrive as one event; the browser decompresses the stream
+      const response = await fetch(`${API_URL}/paper/${paper.id}/process?compress=true&coalesce_ms=250`);
       
       if (!response.ok) {
         throw new Error(`Server responded with ${response.status}`);
@@ -86,34 +87,42 @@ function App() {
       
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      let pending = '';
       
       while (true) {
         const { value, done } = await reader.read();
         if (done) break;
         
-        const text = decoder.decode(value);
-        const lines = text.split('\n').filter(line => line.trim());
+        // Keep any partial line until the rest of it arrives
+        pending += decoder.decode(value, { stream: true });
+        const parts = pending.split('\n');
+        pending = parts.pop();
+        const lines = parts.filter(line => line.trim());
         
         for (const line of lines) {
           try {
             const update = JSON.parse(line);
             
-            if (update.status === 'saving' && update.section) {
-              // Update progress
-              setProcessingProgress(update.progress || 0);
-              setProcessingMessage(`Processing: ${update.section.title}`);
+            if (update.status === 'saving' && (update.section || update.sections)) {
+              const sections = update.sections || [update.section];
               
-              // Add with delay for visual effect
-              setTimeout(() => {
-                setSummaries(prev => [...prev, {
-                  section_title: update.section.title,
-                  summary_text: update.section.summary,
-                  page: update.section.page
-                }]);
-              }, 2000); // Longer delay for better visual effect
-              
-              // Wait a bit before processing the next update to create visual spacing
-              await new Promise(resolve => setTimeout(resolve, 500));
+              for (const section of sections) {
+                // Update progress
+                setProcessingProgress(update.progress || 0);
+                setProcessingMessage(`Processing: ${section.title}`);
+                
+                // Add with delay for visual effect
+                setTimeout(() => {
+                  setSummaries(prev => [...prev, {
+                    section_title: section.title,
+                    summary_text: section.summary,
+                    page: section.page
+                  }]);
+                }, 2000); // Longer delay for better visual effect
+                
+                // Wait a bit before processing the next section to create visual spacing
+                await new Promise(resolve => setTimeout(resolve, 500));
+              }
               
             } else if (update.status === 'complete') {
               setTimeout(() => {